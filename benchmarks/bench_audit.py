@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost the audit log adds to a request, emitting an event to the
+buffer, against writing each event to the file synchronously, and how many
+events per second the background thread writes to the file in batches.
+
+    python benchmarks/bench_audit.py --events 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from discourse_sso_oidc_bridge.audit import AuditLog, JSONLinesFile
+
+
+def event(n):
+    return {
+        "timestamp": round(time.time(), 3),
+        "event": "login",
+        "outcome": "success",
+        "external_id": f"user_{n}",
+        "ip": "10.0.0.1",
+        "latency_ms": {"authentication": 812.4, "sso_auth": 0.3},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+    events = [event(n) for n in range(args.events)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sink = JSONLinesFile(os.path.join(tmp_dir, "sync.jsonl"), max_bytes=0)
+        start = time.perf_counter()
+        for e in events:
+            sink.write([e])
+        sync_seconds = time.perf_counter() - start
+
+        sink = JSONLinesFile(os.path.join(tmp_dir, "audit.jsonl"), max_bytes=0)
+        # Keep the worker idle while emitting, so that only the cost on the
+        # request path is measured, then time writing the buffer in batches
+        audit_log = AuditLog(
+            sink, buffer_size=len(events), batch_size=len(events), flush_interval=3600
+        )
+        start = time.perf_counter()
+        for e in events:
+            audit_log.emit(e)
+        emit_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        audit_log.batch_size = 500
+        audit_log.flush()
+        drain_seconds = time.perf_counter() - start
+        assert audit_log.stats()["written"] == len(events)
+
+    print(f"{'':<28} {'us/event':>10}")
+    print(f"{'synchronous write':<28} {sync_seconds / len(events) * 1e6:>10.2f}")
+    print(f"{'emit to buffer':<28} {emit_seconds / len(events) * 1e6:>10.2f}")
+    print(f"{'batched write':<28} {drain_seconds / len(events) * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost of a compiled CLAIM_TRANSFORMS pipeline on userinfo
+payloads of increasing size, padded with unrelated claims and groups.
+
+    python benchmarks/bench_claims.py
+"""
+
+import argparse
+import timeit
+
+from discourse_sso_oidc_bridge.claims import compile_claim_transforms
+
+TRANSFORMS = [
+    {"op": "lowercase", "claim": "email"},
+    {"op": "extract", "claim": "email", "pattern": "^([^@]+)@", "target": "username"},
+    {
+        "op": "concat",
+        "claims": ["given_name", "family_name"],
+        "target": "name",
+        "separator": " ",
+    },
+    {"op": "filter", "claim": "groups", "pattern": "^discourse-"},
+    {"op": "replace", "claim": "groups", "pattern": "^discourse-", "replacement": ""},
+    {"op": "join", "claim": "groups"},
+]
+
+
+def userinfo(extra_claims, groups):
+    claims = {f"claim_{i}": f"value_{i}" for i in range(extra_claims)}
+    claims.update(
+        {
+            "sub": "john_doe",
+            "email": "John_Doe@Example.com",
+            "given_name": "John",
+            "family_name": "Doe",
+            "groups": [
+                f"discourse-group-{i}" if i % 2 else f"other-group-{i}"
+                for i in range(groups)
+            ],
+        }
+    )
+    return claims
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    transform_claims = compile_claim_transforms(TRANSFORMS)
+
+    print(f"{'claims':>8} {'groups':>8} {'us/transform':>14}")
+    for extra_claims, groups in [(10, 10), (100, 100), (500, 1000)]:
+        claims = userinfo(extra_claims, groups)
+        seconds = min(
+            timeit.repeat(
+                lambda: transform_claims(claims), number=args.number, repeat=5
+            )
+        )
+        print(f"{len(claims):>8} {groups:>8} {seconds / args.number * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Benchmark complete Discourse SSO logins through the bridge served by gunicorn
+with each serving profile, against a stub OIDC provider with a fixed latency.
+
+    pip install -e .[gevent]
+    python benchmarks/bench_serving.py --logins 200 --concurrency 20
+
+To measure the userinfo cache, let a few users log in repeatedly:
+
+    python benchmarks/bench_serving.py --users 20 --userinfo-cache memory
+
+Pass --https to serve the stub OIDC provider over HTTPS with a self-signed
+certificate, as a real provider would be, which the bridge is made to trust.
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urljoin
+
+import requests
+
+from stub_idp import CLIENT_ID, CLIENT_SECRET, StubIdP
+
+PROFILES = ["prefork", "threaded", "cooperative"]
+DISCOURSE_URL = "http://discourse.invalid"
+DISCOURSE_SECRET_KEY = "bench_discourse_secret_key"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def self_signed_cert(directory, host="127.0.0.1"):
+    """Returns the paths to a certificate for host and its key"""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-subj", f"/CN={host}", "-addext", f"subjectAltName=IP:{host}"]
+        + ["-keyout", keyfile, "-out", certfile],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+def sso_login_url(bridge_url, i):
+    payload = base64.b64encode(f"nonce=bench{i}".encode("utf-8")).decode("utf-8")
+    sig = hmac.new(
+        DISCOURSE_SECRET_KEY.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    return f"{bridge_url}/sso/login?sso={quote(payload)}&sig={sig}"
+
+
+def login(bridge_url, i, verify=True):
+    """Follow redirects from /sso/login until we are sent back to Discourse."""
+    start = time.perf_counter()
+    with requests.Session() as session:
+        url = sso_login_url(bridge_url, i)
+        while not url.startswith(DISCOURSE_URL):
+            res = session.get(url, allow_redirects=False, timeout=30, verify=verify)
+            if res.status_code != 302:
+                raise RuntimeError(f"{url} -> {res.status_code}")
+            url = urljoin(url, res.headers["Location"])
+    return time.perf_counter() - start
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except (requests.ConnectionError, requests.Timeout):
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def bench_profile(profile, idp, args):
+    port = free_port()
+    bridge_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        BIND=f"127.0.0.1:{port}",
+        GUNICORN_ACCESSLOG="",
+        OIDC_ISSUER=idp.issuer,
+        OIDC_CLIENT_ID=CLIENT_ID,
+        OIDC_CLIENT_SECRET=CLIENT_SECRET,
+        OIDC_REDIRECT_URI=bridge_url + "/redirect_uri",
+        OIDC_HTTP_POOL_MAXSIZE=str(args.concurrency),
+        DISCOURSE_URL=DISCOURSE_URL,
+        DISCOURSE_SECRET_KEY=DISCOURSE_SECRET_KEY,
+        PREFERRED_URL_SCHEME="http",
+        USERINFO_CACHE=args.userinfo_cache,
+    )
+    if args.cafile:
+        env["REQUESTS_CA_BUNDLE"] = args.cafile
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            f"python:discourse_sso_oidc_bridge_serving.{profile}",
+            "discourse_sso_oidc_bridge:app",
+        ],
+        env=env,
+    )
+    try:
+        wait_for(bridge_url + "/health")
+        userinfo_requests = idp.userinfo_requests
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            latencies = sorted(
+                pool.map(
+                    lambda i: login(bridge_url, i, args.cafile or True),
+                    range(args.logins),
+                )
+            )
+        elapsed = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        "profile": profile,
+        "logins/s": args.logins / elapsed,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p95 ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "userinfo": idp.userinfo_requests - userinfo_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Stub IdP latency in seconds"
+    )
+    parser.add_argument("--profiles", nargs="+", default=PROFILES, choices=PROFILES)
+    parser.add_argument(
+        "--users", type=int, default=0, help="Users logging in, 0 for a new user each"
+    )
+    parser.add_argument(
+        "--userinfo-cache", default="", help="USERINFO_CACHE of the bridge"
+    )
+    parser.add_argument(
+        "--https", action="store_true", help="Serve the stub IdP over HTTPS"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        certfile = keyfile = args.cafile = None
+        if args.https:
+            certfile, keyfile = self_signed_cert(tmp_dir)
+            args.cafile = certfile
+        with StubIdP(
+            latency=args.latency, users=args.users, certfile=certfile, keyfile=keyfile
+        ) as idp:
+            results = [bench_profile(profile, idp, args) for profile in args.profiles]
+
+    print(
+        f"{'profile':<12} {'logins/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'userinfo':>10}"
+    )
+    for r in results:
+        print(
+            f"{r['profile']:<12} {r['logins/s']:>10.1f} {r['p50 ms']:>10.1f} {r['p95 ms']:>10.1f} {r['userinfo']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
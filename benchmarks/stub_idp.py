@@ -0,0 +1,176 @@
+"""
+A stub OIDC provider for benchmarks, serving discovery, authorization, token
+and userinfo endpoints from a thread per request. The token and userinfo
+endpoints wait for a configurable latency to mimic a real provider. Logins
+are by a new user each time, or by one of a fixed number of users in turn.
+Given a certificate, the provider is served over HTTPS.
+
+ID tokens are signed with HS256 using the client secret, which pyoidc verifies
+without needing a JWKS.
+"""
+
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import ssl
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+CLIENT_ID = "bench_client_id"
+CLIENT_SECRET = "bench_client_secret"
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def sign_hs256(claims, secret=CLIENT_SECRET):
+    header = _b64url(json.dumps({"alg": "HS256", "typ": "JWT"}).encode("utf-8"))
+    body = _b64url(json.dumps(claims).encode("utf-8"))
+    signing_input = f"{header}.{body}".encode("ascii")
+    sig = hmac.new(secret.encode("utf-8"), signing_input, hashlib.sha256).digest()
+    return f"{header}.{body}.{_b64url(sig)}"
+
+
+class StubIdP:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.05,
+        users=0,
+        certfile=None,
+        keyfile=None,
+    ):
+        self.latency = latency
+        self.users = users
+        self.codes = {}
+        self.userinfo_requests = 0
+        self._logins = itertools.count()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(
+                self.server.socket, server_side=True
+            )
+            scheme = "https"
+        self.issuer = f"{scheme}://{host}:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def metadata(self):
+        return {
+            "issuer": self.issuer,
+            "authorization_endpoint": self.issuer + "/authorize",
+            "token_endpoint": self.issuer + "/token",
+            "userinfo_endpoint": self.issuer + "/userinfo",
+            "jwks_uri": self.issuer + "/jwks",
+            "response_types_supported": ["code"],
+            "subject_types_supported": ["public"],
+            "id_token_signing_alg_values_supported": ["HS256"],
+        }
+
+    def _make_handler(self):
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/.well-known/openid-configuration":
+                    self._send_json(idp.metadata())
+                elif url.path == "/jwks":
+                    self._send_json({"keys": []})
+                elif url.path == "/authorize":
+                    args = {k: v[0] for k, v in parse_qs(url.query).items()}
+                    code = uuid.uuid4().hex
+                    idp.codes[code] = args["nonce"]
+                    location = (
+                        args["redirect_uri"]
+                        + "?"
+                        + urlencode({"code": code, "state": args["state"]})
+                    )
+                    self.send_response(302)
+                    self.send_header("Location", location)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif url.path == "/userinfo":
+                    with idp._lock:
+                        idp.userinfo_requests += 1
+                    time.sleep(idp.latency)
+                    sub = self.headers["Authorization"].split(" ")[1]
+                    self._send_json(
+                        {
+                            "sub": sub,
+                            "name": "Bench User",
+                            "email": f"{sub}@example.com",
+                            "preferred_username": sub,
+                        }
+                    )
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = {
+                    k: v[0]
+                    for k, v in parse_qs(self.rfile.read(length).decode()).items()
+                }
+                if urlparse(self.path).path != "/token":
+                    self.send_error(404)
+                    return
+                time.sleep(idp.latency)
+                nonce = idp.codes.pop(form["code"])
+                if idp.users:
+                    sub = f"user_{next(idp._logins) % idp.users}"
+                else:
+                    sub = "user_" + form["code"][:8]
+                now = int(time.time())
+                id_token = sign_hs256(
+                    {
+                        "iss": idp.issuer,
+                        "aud": CLIENT_ID,
+                        "sub": sub,
+                        "nonce": nonce,
+                        "iat": now,
+                        "exp": now + 300,
+                    }
+                )
+                self._send_json(
+                    {
+                        "access_token": sub,
+                        "token_type": "Bearer",
+                        "expires_in": 300,
+                        "id_token": id_token,
+                    }
+                )
+
+        return Handler
@@ -22,22 +22,61 @@ from flask_pyoidc.provider_configuration import (
     ClientMetadata,
 )
 
+import atexit
+import functools
 import os
 import re
+import time
 import base64
 import hashlib
 import hmac
 import requests
 import json
+from http.cookiejar import FileCookieJar
 from urllib.parse import quote
 from healthcheck import HealthCheck
+from werkzeug.exceptions import BadRequest
+from .audit import AuditLog, JSONLinesFile, load_sink
+from .backchannel_logout import (
+    DiscourseLogoutQueue,
+    InvalidLogoutToken,
+    verify_logout_token,
+)
+from .claims import compile_claim_transforms, transformed_claims
 from .constants import ALL_ATTRIBUTES, BOOL_ATTRIBUTES, REQUIRED_ATTRIBUTES
 from .default_config import DefaultConfig
+from .profiling import ProfilingMiddleware
+from .stats import Stats, http_pool_stats, public_config_version
+from .userinfo_cache import cache_userinfo_requests, load_userinfo_cache
 
 # Disable SSL certificate verification warning
 requests.packages.urllib3.disable_warnings()
 
 
+class _NullCookieJar(FileCookieJar):
+    """
+    A cookie jar that never stores cookies. pyoidc persists cookies set by the
+    provider in a jar shared by all requests, which would leak state between
+    concurrently served users.
+    """
+
+    def set_cookie(self, cookie):
+        pass
+
+
+def _prepared_response(response_class, status, headers, body=b""):
+    """
+    Make a response from a status, headers and body prepared up front. A new
+    response object is made for each request, as Flask may add user specific
+    headers to it, such as the session cookie.
+    """
+    response = response_class(body, status, headers)
+    # Locations are either absolute or relative to the root, so skip the per
+    # request work of making them absolute.
+    response.autocorrect_location_header = False
+    return response
+
+
 def create_app(config=None):
     app = Flask(__name__, instance_relative_config=True)
 
@@ -93,6 +132,33 @@ def create_app(config=None):
         }
     )
 
+    # Compile how userinfo claims are turned into Discourse SSO attributes
+    # ------------------------------------------------------------------------------
+    transform_claims = compile_claim_transforms(app.config["CLAIM_TRANSFORMS"])
+
+    # A userinfo claim provides a Discourse SSO attribute if it is...
+    # 1. explicitly mapped using the provided map
+    # 2. if it can match one of the known attributes with discourse_ prefixed
+    # 3. if it can match one of the known attributes directly
+    attribute_keys = {attr: attr for attr in ALL_ATTRIBUTES}
+    attribute_keys.update({"discourse_" + attr: attr for attr in ALL_ATTRIBUTES})
+    attribute_keys.update(
+        {
+            userinfo_key: attribute_key
+            for userinfo_key, attribute_key in app.config["USERINFO_SSO_MAP"].items()
+            if attribute_key
+        }
+    )
+
+    # Initialize statistics reported by /debug/stats
+    # ------------------------------------------------------------------------------
+    stats = Stats()
+    config_version = public_config_version(app.config)
+    stats.register_source("config", lambda: {"version": config_version})
+    # Sessions are stored client side in signed cookies, so there is no session
+    # store with a size or evictions to report.
+    stats.register_source("session", lambda: {"backend": "cookie"})
+
     # Initialize OpenID Connect extension
     # ------------------------------------------------------------------------------
 
@@ -100,6 +166,16 @@ def create_app(config=None):
     # https://github.com/zamzterz/Flask-pyoidc#dynamic-provider-configuration
     client_metadata = ClientMetadata(**app.config["OIDC_CLIENT_METADATA"])
 
+    # Requests to the OIDC provider reuse connections from a pool that should be
+    # sized to match the number of threads or greenlets serving requests.
+    requests_session = requests.Session()
+    requests_adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=app.config["OIDC_HTTP_POOL_MAXSIZE"]
+    )
+    requests_session.mount("http://", requests_adapter)
+    requests_session.mount("https://", requests_adapter)
+    stats.register_source("http_pools", lambda: http_pool_stats(requests_session))
+
     # ... but if explicit OIDC provider information is provided, we use that
     # instead of the information dynamically provided by the
     # .well-known/openid-configuration endpoint.
@@ -109,12 +185,14 @@ def create_app(config=None):
             provider_metadata=provider_metadata,
             client_metadata=client_metadata,
             auth_request_params=app.config["OIDC_AUTH_REQUEST_PARAMS"],
+            requests_session=requests_session,
         )
     else:
         provider = ProviderConfiguration(
             issuer=app.config["OIDC_ISSUER"],
             client_metadata=client_metadata,
             auth_request_params=app.config["OIDC_AUTH_REQUEST_PARAMS"],
+            requests_session=requests_session,
         )
 
     auth = OIDCAuthentication(
@@ -123,6 +201,122 @@ def create_app(config=None):
         },
         app=app,
     )
+    app.extensions["oidc_auth"] = auth
+
+    # The app may be created before a WSGI server forks its workers, so make
+    # sure no connection opened during provider discovery is inherited, and
+    # that the pyoidc clients shared by all requests keep no cookies.
+    requests_session.close()
+    for client in auth.clients.values():
+        client._client.cookiejar = _NullCookieJar()
+
+    # Cache userinfo responses if requested
+    # ------------------------------------------------------------------------------
+    userinfo_cache = None
+    if app.config["USERINFO_CACHE"]:
+        userinfo_cache = load_userinfo_cache(
+            app.config["USERINFO_CACHE"],
+            issuer=auth.clients["default"]._client.provider_info["issuer"],
+            maxsize=app.config["USERINFO_CACHE_MAXSIZE"],
+            ttl=app.config["USERINFO_CACHE_TTL"],
+        )
+        cache_userinfo_requests(auth.clients["default"], userinfo_cache)
+        app.extensions["userinfo_cache"] = userinfo_cache
+        stats.register_source("userinfo_cache", userinfo_cache.stats)
+
+    def invalidates_cached_userinfo(view_func):
+        """
+        Invalidate the cached userinfo of the user in the session, before
+        view_func logs the user out and clears the session. With the memory
+        backend, only this worker process's cache is invalidated.
+        """
+
+        @functools.wraps(view_func)
+        def wrapper(*args, **kwargs):
+            sub = (session.get("id_token") or {}).get("sub")
+            if userinfo_cache is not None and sub:
+                userinfo_cache.invalidate(sub)
+            return view_func(*args, **kwargs)
+
+        return wrapper
+
+    # Initialize back-channel logout if a Discourse API key is available
+    # ------------------------------------------------------------------------------
+    logout_queue = None
+    if app.config["DISCOURSE_API_KEY"]:
+        # Logout tokens carry the provider's claims untransformed, so a user
+        # whose external_id is derived by CLAIM_TRANSFORMS couldn't be found.
+        for claim in transformed_claims(app.config["CLAIM_TRANSFORMS"]):
+            if attribute_keys.get(claim) == "external_id":
+                raise ValueError(
+                    f"CLAIM_TRANSFORMS: {claim} is mapped to external_id and can't be transformed when back-channel logout is enabled with DISCOURSE_API_KEY"
+                )
+        logout_queue = DiscourseLogoutQueue(
+            discourse_url=app.config["DISCOURSE_URL"],
+            api_key=app.config["DISCOURSE_API_KEY"],
+            api_username=app.config["DISCOURSE_API_USERNAME"],
+            maxsize=app.config["BACKCHANNEL_LOGOUT_QUEUE_SIZE"],
+            batch_size=app.config["BACKCHANNEL_LOGOUT_BATCH_SIZE"],
+            max_attempts=app.config["BACKCHANNEL_LOGOUT_MAX_ATTEMPTS"],
+            retry_delay=app.config["BACKCHANNEL_LOGOUT_RETRY_DELAY"],
+        )
+        app.extensions["discourse_logout_queue"] = logout_queue
+        stats.register_source("backchannel_logout", logout_queue.stats)
+
+    # The logout token identifies the user with the same claims as the ID
+    # token, so look for the claim mapped to external_id by USERINFO_SSO_MAP.
+    external_id_claim = next(
+        (
+            userinfo_key
+            for userinfo_key, attribute_key in app.config["USERINFO_SSO_MAP"].items()
+            if attribute_key == "external_id"
+        ),
+        "external_id",
+    )
+
+    # Initialize the audit log if a sink is configured
+    # ------------------------------------------------------------------------------
+    audit_log = None
+    if app.config["AUDIT_SINK"] or app.config["AUDIT_LOG_PATH"]:
+        if app.config["AUDIT_SINK"]:
+            audit_sink = load_sink(app.config["AUDIT_SINK"])
+        else:
+            audit_sink = JSONLinesFile(
+                app.config["AUDIT_LOG_PATH"],
+                max_bytes=app.config["AUDIT_LOG_MAX_BYTES"],
+                backup_count=app.config["AUDIT_LOG_BACKUP_COUNT"],
+            )
+        audit_log = AuditLog(
+            audit_sink,
+            buffer_size=app.config["AUDIT_BUFFER_SIZE"],
+            batch_size=app.config["AUDIT_BATCH_SIZE"],
+            flush_interval=app.config["AUDIT_FLUSH_INTERVAL"],
+        )
+        app.extensions["audit_log"] = audit_log
+        stats.register_source("audit", audit_log.stats)
+        # Write what is still buffered when a worker process exits normally
+        atexit.register(audit_log.flush, timeout=5)
+
+    def audit(outcome, external_id=None, **latencies):
+        """
+        Record a login, or a login aborted with outcome, in the audit log. The
+        latencies of the stages of the login are passed in seconds.
+        """
+        if audit_log is None:
+            return
+        audit_log.emit(
+            {
+                "timestamp": round(time.time(), 3),
+                "event": "login" if outcome == "success" else "abort",
+                "outcome": outcome,
+                "external_id": external_id,
+                "ip": request.remote_addr,
+                "latency_ms": {
+                    stage: round(seconds * 1000, 1)
+                    for stage, seconds in latencies.items()
+                },
+            }
+        )
 
     # The /health endpoint returns a JSON string like...
     # {"hostname": "a3731af16461", "status": "success", "timestamp": 1551186453.8854501, "results": []}
@@ -141,7 +335,7 @@ def create_app(config=None):
         just redirect them to Discourse.
         :return: Redirect to the configurated DISCOURSE_URL
         """
-        return redirect(app.config.get("DISCOURSE_URL"), 302)
+        return _prepared_response(app.response_class, 302, index_headers)
 
     @app.route("/sso/login")
     def payload_check():
@@ -152,6 +346,7 @@ def create_app(config=None):
 
         :return: The redirection page to the authentication page
         """
+        started = time.perf_counter()
 
         # Get payload and signature from Discourse request
         payload = request.args.get("sso", "")
@@ -163,6 +358,11 @@ def create_app(config=None):
                 payload,
                 signature,
             )
+            stats.incr("aborts.sso_login.missing_payload_or_signature")
+            audit(
+                "sso_login.missing_payload_or_signature",
+                sso_login=time.perf_counter() - started,
+            )
             abort(400)
 
         app.logger.debug(
@@ -173,7 +373,7 @@ def create_app(config=None):
 
         # Calculate and compare request signature
         dig = hmac.new(
-            app.config.get("DISCOURSE_SECRET_KEY", "").encode("utf-8"),
+            discourse_secret_key,
             payload.encode("utf-8"),
             hashlib.sha256,
         ).hexdigest()
@@ -185,6 +385,10 @@ def create_app(config=None):
                 dig,
                 signature,
             )
+            stats.incr("aborts.sso_login.signature_mismatch")
+            audit(
+                "sso_login.signature_mismatch", sso_login=time.perf_counter() - started
+            )
             abort(400)
 
         # Decode the payload and store in session
@@ -192,11 +396,19 @@ def create_app(config=None):
         session[
             "discourse_nonce"
         ] = decoded_msg  # This can't just be 'nonce' as Flask-pyoidc will steamroll it
+        if audit_log is not None:
+            # Lets the audit log report the time spent authenticating with the IdP
+            session["discourse_sso_started"] = time.time()
 
         # Redirect to authorization endpoint
-        return redirect(url_for("sso_auth"))
+        return _prepared_response(
+            app.response_class,
+            302,
+            [("Location", request.script_root + sso_auth_path), no_store_header],
+        )
 
     @app.route("/sso/auth")
+    @stats.in_flight("sso_auth")
     @auth.oidc_auth("default")
     def sso_auth():
         """
@@ -204,33 +416,28 @@ def create_app(config=None):
         create the payload to send to Discourse.
         :return: The redirection page to Discourse
         """
+        started = time.perf_counter()
 
         # Check to make sure we have a valid session
         if "discourse_nonce" not in session:
             app.logger.info(
                 "/sso/auth -> 403: discourse_nonce not found in session, arriving here without coming from /sso/login?"
             )
+            stats.incr("aborts.sso_auth.missing_discourse_nonce")
+            audit(
+                "sso_auth.missing_discourse_nonce",
+                external_id=session.get("userinfo", {}).get(external_id_claim),
+                sso_auth=time.perf_counter() - started,
+            )
             abort(403)
 
-        attribute_map = app.config.get("USERINFO_SSO_MAP")
-
         sso_attributes = {}
-        userinfo = session["userinfo"]
+        userinfo = transform_claims(session["userinfo"])
 
         # Check if the provided userinfo should be used to set information to be
-        # passed to discourse. Do it by checking if the userinfo field is...
-        # 1. explicitly mapped using the provided map
-        # 2. if it can match one of the known attributes with discourse_ prefixed
-        # 3. if it can match one of the known attributes directly
+        # passed to discourse, using the mapping compiled in create_app.
         for userinfo_key, userinfo_value in userinfo.items():
-            attribute_key = attribute_map.get(userinfo_key)
-
-            if attribute_key:
-                pass
-            elif userinfo_key in ["discourse_" + attr for attr in ALL_ATTRIBUTES]:
-                attribute_key = userinfo_key[len("discourse_") :]
-            elif userinfo_key in ALL_ATTRIBUTES:
-                attribute_key = userinfo_key
+            attribute_key = attribute_keys.get(userinfo_key)
 
             if attribute_key:
                 if attribute_key in BOOL_ATTRIBUTES:
@@ -256,6 +463,12 @@ def create_app(config=None):
                 app.logger.info(
                     f"/sso/auth -> 403: {required_attribute} not found in userinfo: {json.dumps(session['userinfo'])}"
                 )
+                stats.incr("aborts.sso_auth.missing_required_attribute")
+                audit(
+                    "sso_auth.missing_required_attribute",
+                    external_id=sso_attributes.get("external_id"),
+                    sso_auth=time.perf_counter() - started,
+                )
                 abort(403)
 
         # All systems are go!
@@ -279,7 +492,7 @@ def create_app(config=None):
 
         # Generate signature for response
         sig = hmac.new(
-            app.config.get("DISCOURSE_SECRET_KEY").encode("utf-8"),
+            discourse_secret_key,
             query_b64,
             hashlib.sha256,
         ).hexdigest()
@@ -287,15 +500,23 @@ def create_app(config=None):
         app.logger.debug("Signature: %s", sig)
 
         # Build redirect URL
-        redirect_url = (
-            app.config.get("DISCOURSE_URL") + "/session/sso_login?"
-            "sso=" + query_urlenc + "&sig=" + sig
-        )
+        redirect_url = discourse_sso_login_url + query_urlenc + "&sig=" + sig
 
         # Redirect back to Discourse
-        return redirect(redirect_url)
+        stats.incr("logins")
+        if audit_log is not None:
+            latencies = {"sso_auth": time.perf_counter() - started}
+            if "discourse_sso_started" in session:
+                latencies["authentication"] = (
+                    time.time() - session["discourse_sso_started"]
+                )
+            audit("success", external_id=sso_attributes.get("external_id"), **latencies)
+        return _prepared_response(
+            app.response_class, 302, [("Location", redirect_url), no_store_header]
+        )
 
     @app.route("/logout")
+    @invalidates_cached_userinfo
     @auth.oidc_logout
     def logout():
         """
@@ -304,6 +525,71 @@ def create_app(config=None):
         """
         return redirect(url_for("index"), 302)
 
+    @app.route("/backchannel_logout", methods=["POST"])
+    def backchannel_logout():
+        """
+        Verify a logout token sent by the OIDC provider and queue the user to be
+        logged out of Discourse.
+        :return: An empty response, or an error if the logout failed
+        """
+        if logout_queue is None:
+            abort(404)
+
+        client = auth.clients["default"]._client
+        try:
+            claims = verify_logout_token(
+                request.form.get("logout_token", ""),
+                keyjar=client.keyjar,
+                issuer=client.provider_info["issuer"],
+                client_id=client.client_id,
+            )
+        except InvalidLogoutToken as e:
+            app.logger.info("/backchannel_logout -> 400: %s", e)
+            stats.incr("aborts.backchannel_logout.invalid_logout_token")
+            abort(400)
+
+        external_id = claims.get(external_id_claim)
+        if not external_id:
+            app.logger.info(
+                "/backchannel_logout -> 400: %s not found in logout token: %s",
+                external_id_claim,
+                json.dumps(claims),
+            )
+            stats.incr("aborts.backchannel_logout.missing_external_id")
+            abort(400)
+
+        if not logout_queue.put(str(external_id)):
+            app.logger.warning(
+                "/backchannel_logout -> 503: queue full, dropped logout of %s",
+                external_id,
+            )
+            stats.incr("aborts.backchannel_logout.queue_full")
+            abort(503)
+
+        if userinfo_cache is not None and claims.get("sub"):
+            userinfo_cache.invalidate(claims["sub"])
+
+        return _prepared_response(app.response_class, 200, [no_store_header])
+
+    @app.route("/debug/stats")
+    def debug_stats():
+        """
+        Report statistics about the worker process serving the request, if
+        DEBUG_STATS_TOKEN is configured and passed as a bearer token.
+        :return: Statistics as JSON
+        """
+        token = app.config.get("DEBUG_STATS_TOKEN")
+        if not token:
+            abort(404)
+
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(
+            authorization.encode("utf-8"), f"Bearer {token}".encode("utf-8")
+        ):
+            abort(401)
+
+        return jsonify(stats.snapshot())
+
     @app.errorhandler(403)
     def attribute_not_provided(error):
         """
@@ -311,8 +597,53 @@ def create_app(config=None):
         not provide the requested attributes
         :type error: object
         """
-        app.logger.info(f'403: error: "{error}"')
-        return render_template("403.html"), 403
+        app.logger.info('403: error: "%s"', error)
+        return _prepared_response(
+            app.response_class, 403, error_headers, forbidden_body
+        )
+
+    @app.errorhandler(400)
+    def bad_request(error):
+        """
+        Respond with a prepared error page to requests from Discourse that fail
+        validation, so that a flood of bad requests stays cheap.
+        :type error: object
+        """
+        return _prepared_response(
+            app.response_class, 400, error_headers, bad_request_body
+        )
+
+    # Prepare static responses
+    # ------------------------------------------------------------------------------
+    # Redirect targets and error pages don't change after the app is created,
+    # so they are prepared once here instead of for each request. Responses
+    # with user specific content or cookies must not be cached. The index
+    # redirect may be cached by the browser only, as a permanent session is
+    # refreshed with a Set-Cookie header on every response.
+    no_store_header = ("Cache-Control", "no-store")
+    index_headers = [
+        ("Location", app.config["DISCOURSE_URL"]),
+        ("Cache-Control", "private, max-age=300"),
+    ]
+    discourse_sso_login_url = app.config["DISCOURSE_URL"] + "/session/sso_login?sso="
+    discourse_secret_key = app.config["DISCOURSE_SECRET_KEY"].encode("utf-8")
+    error_headers = [("Content-Type", "text/html; charset=utf-8"), no_store_header]
+    bad_request_body = BadRequest().get_body().encode("utf-8")
+    with app.test_request_context():
+        sso_auth_path = url_for("sso_auth")
+        forbidden_body = render_template("403.html").encode("utf-8")
+
+    # Wrap the app with a profiler if requested
+    # ------------------------------------------------------------------------------
+    if app.config["PROFILING_DIR"]:
+        app.wsgi_app = ProfilingMiddleware(
+            app.wsgi_app,
+            profile_dir=app.config["PROFILING_DIR"],
+            sample_rate=app.config["PROFILING_SAMPLE_RATE"],
+            paths=re.split(",| ", app.config["PROFILING_PATHS"]),
+            slow_request_seconds=app.config["PROFILING_SLOW_REQUEST_SECONDS"],
+            max_files=app.config["PROFILING_MAX_FILES"],
+        )
 
     return app
 
@@ -0,0 +1,175 @@
+"""
+An audit trail of logins, with one compact event per login or aborted login.
+
+Events are appended to a bounded in-memory buffer on the request path, and a
+background thread drains the buffer in batches to a sink, by default a
+rotated file with one JSON object per line. Nothing is serialized or written
+while a request is served, and when the sink can't keep up and the buffer is
+full, new events are dropped and counted instead of blocking requests.
+"""
+
+import collections
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+
+from .background import BackgroundThread
+
+logger = logging.getLogger(__name__)
+
+
+class JSONLinesFile(object):
+    """
+    A sink writing events as JSON lines to a file, rotated when it would grow
+    beyond max_bytes by renaming it with a .1 suffix, and older files with
+    higher suffixes, keeping at most backup_count old files.
+
+    The path may contain {pid} to write one file per worker process, which
+    should be done when multiple processes would otherwise rotate the same
+    file. A path of "-" writes to stdout without rotation.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._stream = None
+
+    def write(self, events):
+        data = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in events)
+        if self.path == "-":
+            sys.stdout.write(data)
+            sys.stdout.flush()
+            return
+
+        if self._stream is None:
+            self._stream = open(self._path(), "a", encoding="utf-8")
+        if (
+            self.max_bytes
+            and self._stream.tell()
+            and self._stream.tell() + len(data) > self.max_bytes
+        ):
+            self._rotate()
+        self._stream.write(data)
+        self._stream.flush()
+
+    def _path(self):
+        return self.path.format(pid=os.getpid())
+
+    def _rotate(self):
+        self._stream.close()
+        path = self._path()
+        if self.backup_count:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{path}.{i}"):
+                    os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+            os.replace(path, f"{path}.1")
+        self._stream = open(path, "w", encoding="utf-8")
+
+
+def load_sink(sink):
+    """
+    Returns a sink given either an object with a write(events) method, or an
+    import path like "package.module:name" of a callable returning one.
+    """
+    if isinstance(sink, str):
+        module_name, _, name = sink.partition(":")
+        if not name:
+            raise ValueError(f"AUDIT_SINK: expected 'module:name', got {sink!r}")
+        sink = getattr(importlib.import_module(module_name), name)()
+    if not callable(getattr(sink, "write", None)):
+        raise ValueError(f"AUDIT_SINK: {sink!r} has no write(events) method")
+    return sink
+
+
+class AuditLog(object):
+    """
+    A bounded buffer of audit events drained to a sink by a background thread.
+    Events are written in batches of up to batch_size, as soon as a batch is
+    full or at least every flush_interval seconds.
+    """
+
+    def __init__(self, sink, buffer_size=10000, batch_size=500, flush_interval=1.0):
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._buffer = collections.deque()
+        self._cond = threading.Condition()
+        self._flush_requested = False
+        self._writing = False
+        self.worker = BackgroundThread(self._run, name="audit-log")
+        self._counts = {"emitted": 0, "written": 0, "dropped": 0, "failed": 0}
+
+    def emit(self, event):
+        """
+        Add an event to the buffer without blocking.
+        :return: False if the buffer is full and the event was dropped
+        """
+        self.worker.ensure_started()
+        with self._cond:
+            if len(self._buffer) >= self.buffer_size:
+                self._counts["dropped"] += 1
+                return False
+            self._buffer.append(event)
+            self._counts["emitted"] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Block until all buffered events have been passed to the sink.
+        :return: False if the timeout expired first
+        """
+        with self._cond:
+            if not self._buffer and not self._writing:
+                return True
+        self.worker.ensure_started()
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._buffer and not self._writing, timeout
+            )
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counts)
+            stats["buffered"] = len(self._buffer)
+        stats["buffer_size"] = self.buffer_size
+        return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._flush_requested
+                    or len(self._buffer) >= self.batch_size,
+                    self.flush_interval,
+                )
+                batch = []
+                while self._buffer and len(batch) < self.batch_size:
+                    batch.append(self._buffer.popleft())
+                if not self._buffer:
+                    self._flush_requested = False
+                self._writing = bool(batch)
+            if not batch:
+                continue
+
+            try:
+                self.sink.write(batch)
+            except Exception:
+                logger.exception("Failed to write %d audit events", len(batch))
+                written, failed = 0, len(batch)
+            else:
+                written, failed = len(batch), 0
+            with self._cond:
+                self._counts["written"] += written
+                self._counts["failed"] += failed
+                self._writing = False
+                self._cond.notify_all()
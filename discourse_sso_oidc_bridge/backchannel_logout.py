@@ -0,0 +1,212 @@
+"""
+OpenID Connect back-channel logout, propagating logouts from the OIDC provider
+to Discourse.
+
+The provider POSTs a signed logout token to /backchannel_logout when a user
+logs out or is disabled. The token is verified in the request, and the user's
+Discourse external_id is put on a bounded queue. A background thread drains
+the queue in batches, logging users out through the Discourse API with
+retries, so that bulk deprovisioning doesn't block request workers.
+
+ref: https://openid.net/specs/openid-connect-backchannel-1_0.html
+"""
+
+import base64
+import json
+import logging
+import queue
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from oic.oic.message import BackChannelLogoutRequest
+
+from .background import BackgroundThread
+
+logger = logging.getLogger(__name__)
+
+# Logout tokens issued longer ago than this are rejected as possible replays
+LOGOUT_TOKEN_MAX_AGE_SECONDS = 300
+
+
+class InvalidLogoutToken(Exception):
+    pass
+
+
+def verify_logout_token(logout_token, keyjar, issuer, client_id):
+    """
+    Verify a logout token's signature using the provider's keys in the keyjar,
+    which caches the provider's JWKS, and validate its claims.
+
+    :return: The claims of the logout token
+    :raises InvalidLogoutToken: If the logout token isn't valid
+    """
+    try:
+        header = json.loads(
+            base64.urlsafe_b64decode(logout_token.split(".")[0] + "==").decode("utf-8")
+        )
+    except ValueError as e:
+        raise InvalidLogoutToken(f"malformed logout token: {e}")
+    if not isinstance(header, dict):
+        raise InvalidLogoutToken("malformed logout token: header isn't an object")
+    alg = header.get("alg", "none")
+    if not isinstance(alg, str):
+        raise InvalidLogoutToken(f"logout token has an invalid alg: {alg!r}")
+    # pyoidc accepts unsigned tokens, but logout tokens must be signed
+    if alg.lower() == "none":
+        raise InvalidLogoutToken("logout token is not signed")
+
+    request = BackChannelLogoutRequest(logout_token=logout_token)
+    try:
+        request.verify(keyjar=keyjar, iss=issuer, aud=client_id)
+    except Exception as e:
+        raise InvalidLogoutToken(f"{e.__class__.__name__}: {e}")
+
+    claims = request["logout_token"].to_dict()
+    if claims["iat"] < time.time() - LOGOUT_TOKEN_MAX_AGE_SECONDS:
+        raise InvalidLogoutToken("logout token has expired")
+    return claims
+
+
+class DiscourseLogoutQueue(object):
+    """
+    A bounded queue of Discourse external_id's to log out, drained by a
+    background thread. Putting on the queue never blocks, when the queue is
+    full the logout is dropped and the caller should report failure.
+    """
+
+    def __init__(
+        self,
+        discourse_url,
+        api_key,
+        api_username="system",
+        maxsize=1000,
+        batch_size=50,
+        max_attempts=5,
+        retry_delay=1.0,
+        timeout=10,
+    ):
+        self.discourse_url = discourse_url
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.headers = {"Api-Key": api_key, "Api-Username": api_username}
+
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self.worker = BackgroundThread(self._run, name="discourse-logout")
+        self._counts = {
+            "logged_out": 0,
+            "not_found": 0,
+            "failed": 0,
+            "retries": 0,
+            "dropped": 0,
+        }
+
+    def put(self, external_id):
+        """
+        Queue a Discourse user to be logged out.
+        :return: False if the queue is full, otherwise True
+        """
+        self.worker.ensure_started()
+        try:
+            self._queue.put_nowait(external_id)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        return True
+
+    def join(self):
+        """Block until all queued logouts have been processed."""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        stats["queued"] = self._queue.qsize()
+        stats["maxsize"] = self._queue.maxsize
+        return stats
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counts[name] += value
+
+    def _run(self):
+        session = requests.Session()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._process_batch(session, batch)
+            except Exception:
+                logger.exception("Failed to process a batch of Discourse logouts")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _process_batch(self, session, batch):
+        # A user may be logged out by multiple logout tokens, for example one
+        # per session, but only needs to be logged out of Discourse once.
+        pending = list(dict.fromkeys(batch))
+        for attempt in range(1, self.max_attempts + 1):
+            failed = []
+            for external_id in pending:
+                if not self._log_out(session, external_id):
+                    failed.append(external_id)
+            if not failed:
+                return
+            if attempt < self.max_attempts:
+                self._count("retries", len(failed))
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            pending = failed
+
+        logger.warning(
+            "Giving up logging out %d Discourse users after %d attempts: %s",
+            len(pending),
+            self.max_attempts,
+            pending,
+        )
+        self._count("failed", len(pending))
+
+    def _log_out(self, session, external_id):
+        """
+        Log out a user from Discourse.
+        :return: False if the request should be retried, otherwise True
+        """
+        try:
+            res = session.get(
+                f"{self.discourse_url}/u/by-external/{quote(external_id, safe='')}.json",
+                headers=self.headers,
+                timeout=self.timeout,
+            )
+            if res.status_code == 404:
+                # The user has never logged in to Discourse
+                self._count("not_found")
+                return True
+            res.raise_for_status()
+            user_id = res.json()["user"]["id"]
+
+            res = session.post(
+                f"{self.discourse_url}/admin/users/{user_id}/log_out.json",
+                headers=self.headers,
+                timeout=self.timeout,
+            )
+            res.raise_for_status()
+        except (requests.RequestException, ValueError, KeyError) as e:
+            status_code = getattr(getattr(e, "response", None), "status_code", None)
+            logger.info(f"Failed to log out {external_id} from Discourse: {e}")
+            if status_code is not None and status_code < 500 and status_code != 429:
+                # Retrying won't help with errors like a bad API key
+                self._count("failed")
+                return True
+            return False
+
+        logger.debug(f"Logged out {external_id} from Discourse")
+        self._count("logged_out")
+        return True
@@ -0,0 +1,53 @@
+"""
+Background threads for work that shouldn't block requests.
+
+The app may be created before a WSGI server forks its worker processes, and
+threads don't survive a fork, so a thread is started lazily when first needed
+in each process rather than when the app is created.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+
+class BackgroundThread(object):
+    """
+    A daemon thread running target, started by ensure_started in each process
+    that needs it. target is expected to loop forever.
+    """
+
+    def __init__(self, target, name):
+        self.target = target
+        self.name = name
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._held = 0
+
+    def ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._held or (self._pid == os.getpid() and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(
+                target=self.target, name=self.name, daemon=True
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    @contextmanager
+    def held(self):
+        """
+        Defer starting the thread until the end of the block, for example to
+        queue work that should be picked up all at once.
+        """
+        with self._lock:
+            self._held += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._held -= 1
+        self.ensure_started()
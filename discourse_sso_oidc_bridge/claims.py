@@ -0,0 +1,191 @@
+"""
+A declarative pipeline of transformations applied to the userinfo claims before
+they are mapped to Discourse SSO attributes, configured with CLAIM_TRANSFORMS.
+
+The pipeline is validated and compiled once into a chain of Python callables
+when the app is created, with regular expressions precompiled, so nothing is
+parsed per request. Each transformation is a dict with an "op" key, and
+transformations are applied in order:
+
+- {"op": "copy", "claim": "email", "target": "username"}
+- {"op": "lowercase", "claim": "email"}
+- {"op": "concat", "claims": ["given_name", "family_name"], "target": "name", "separator": " "}
+- {"op": "extract", "claim": "email", "pattern": "^([^@]+)@", "target": "username"}
+- {"op": "replace", "claim": "username", "pattern": "[^a-z0-9_.-]", "replacement": "_"}
+- {"op": "filter", "claim": "groups", "pattern": "^discourse-"}
+- {"op": "join", "claim": "groups", "separator": ","}
+
+Unless a "target" claim is given, a transformation updates its claim in place.
+Transformations of claims missing from the userinfo are skipped, and lowercase
+and replace apply to each value of list claims like groups.
+"""
+
+import re
+
+
+def _apply(value, func):
+    if isinstance(value, (list, tuple)):
+        return [func(str(v)) for v in value]
+    return func(str(value))
+
+
+def _compile_copy(claim, target):
+    def copy(claims):
+        if claim in claims:
+            claims[target] = claims[claim]
+
+    return copy
+
+
+def _compile_lowercase(claim, target=None):
+    target = target or claim
+
+    def lowercase(claims):
+        if claim in claims:
+            claims[target] = _apply(claims[claim], str.lower)
+
+    return lowercase
+
+
+def _compile_concat(claims, target, separator=" "):
+    sources = list(claims)
+
+    def concat(claims):
+        values = [str(claims[c]) for c in sources if claims.get(c) not in (None, "")]
+        if values:
+            claims[target] = separator.join(values)
+
+    return concat
+
+
+def _compile_extract(claim, pattern, target=None):
+    target = target or claim
+    regex = _compile_regex(pattern)
+    group = 1 if regex.groups else 0
+
+    def extract(claims):
+        if claim in claims:
+            match = regex.search(str(claims[claim]))
+            if match:
+                claims[target] = match.group(group)
+
+    return extract
+
+
+def _compile_replace(claim, pattern, replacement, target=None):
+    target = target or claim
+    regex = _compile_regex(pattern)
+    if not isinstance(replacement, str):
+        raise ValueError("replacement must be a string")
+    try:
+        # validates group references in the replacement up front
+        regex.sub(replacement, "")
+    except re.error as e:
+        raise ValueError(f"invalid replacement {replacement!r}: {e}")
+
+    def sub(value):
+        return regex.sub(replacement, value)
+
+    def replace(claims):
+        if claim in claims:
+            claims[target] = _apply(claims[claim], sub)
+
+    return replace
+
+
+def _compile_filter(claim, pattern, target=None):
+    target = target or claim
+    search = _compile_regex(pattern).search
+
+    def filter_(claims):
+        if claim in claims:
+            values = claims[claim]
+            if isinstance(values, str):
+                values = values.split(",")
+            claims[target] = [v for v in values if search(str(v))]
+
+    return filter_
+
+
+def _compile_join(claim, separator=",", target=None):
+    target = target or claim
+
+    def join(claims):
+        values = claims.get(claim)
+        if isinstance(values, (list, tuple)):
+            claims[target] = separator.join(str(v) for v in values)
+
+    return join
+
+
+def _check_types(transform):
+    """
+    Check that claim names and separators are strings, as they would otherwise
+    only fail when a user logs in.
+    """
+    for key in ["claim", "target", "separator"]:
+        if key in transform and not isinstance(transform[key], str):
+            raise ValueError(f"{key} must be a string")
+    if "claims" in transform:
+        claims = transform["claims"]
+        if not isinstance(claims, list) or not all(isinstance(c, str) for c in claims):
+            raise ValueError("claims must be a list of claim names")
+
+
+def _compile_regex(pattern):
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"invalid pattern {pattern!r}: {e}")
+
+
+OPERATIONS = {
+    "copy": _compile_copy,
+    "lowercase": _compile_lowercase,
+    "concat": _compile_concat,
+    "extract": _compile_extract,
+    "replace": _compile_replace,
+    "filter": _compile_filter,
+    "join": _compile_join,
+}
+
+
+def compile_claim_transforms(transforms):
+    """
+    Validate and compile a list of claim transformations.
+
+    :return: A function taking userinfo claims and returning transformed claims
+    :raises ValueError: If a transformation isn't valid
+    """
+    steps = []
+    for i, transform in enumerate(transforms):
+        transform = dict(transform)
+        op = transform.pop("op", None)
+        if op not in OPERATIONS:
+            raise ValueError(
+                f"CLAIM_TRANSFORMS[{i}]: unknown op {op!r}, expected one of {sorted(OPERATIONS)}"
+            )
+        try:
+            _check_types(transform)
+            steps.append(OPERATIONS[op](**transform))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"CLAIM_TRANSFORMS[{i}]: invalid {op!r} transform: {e}")
+
+    if not steps:
+        return lambda userinfo: userinfo
+
+    def transform_claims(userinfo):
+        claims = dict(userinfo)
+        for step in steps:
+            step(claims)
+        return claims
+
+    return transform_claims
+
+
+def transformed_claims(transforms):
+    """
+    Returns the names of the claims that a list of valid claim transformations
+    may write to.
+    """
+    return {t.get("target") or t.get("claim") for t in transforms}
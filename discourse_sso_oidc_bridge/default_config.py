@@ -42,6 +42,24 @@ class DefaultConfig(object):
     # https://github.com/zamzterz/Flask-pyoidc#static-provider-configuration
     OIDC_PROVIDER_METADATA = json.loads(os.environ.get("OIDC_PROVIDER_METADATA", "{}"))
 
+    # The number of connections to the OIDC provider kept open for reuse by each
+    # worker process. Should be at least the number of requests served
+    # concurrently by a worker, for example its number of threads or greenlets.
+    OIDC_HTTP_POOL_MAXSIZE = int(os.environ.get("OIDC_HTTP_POOL_MAXSIZE", "10"))
+
+    # Set USERINFO_CACHE to skip the userinfo request for users that logged in
+    # less than USERINFO_CACHE_TTL seconds ago. Set it to "memory" to cache up
+    # to USERINFO_CACHE_MAXSIZE users in each worker process, or to a
+    # redis://host:port/db URL to share a cache in Redis between workers, which
+    # requires the redis package. Changes to a user's claims at the OIDC
+    # provider may take up to USERINFO_CACHE_TTL seconds to reach Discourse.
+    # Logouts invalidate a user's cached userinfo in all workers only with
+    # Redis, the "memory" cache is only invalidated in the worker handling the
+    # logout.
+    USERINFO_CACHE = os.environ.get("USERINFO_CACHE", "")
+    USERINFO_CACHE_TTL = int(os.environ.get("USERINFO_CACHE_TTL", "60"))
+    USERINFO_CACHE_MAXSIZE = int(os.environ.get("USERINFO_CACHE_MAXSIZE", "10000"))
+
     ###########################
     # Discourse Configuration #
     ###########################
@@ -54,6 +72,30 @@ class DefaultConfig(object):
         "DISCOURSE_SECRET_KEY", "dummy_discourse_secret_key"
     )
 
+    # Set DISCOURSE_API_KEY to enable OIDC back-channel logout, letting the OIDC
+    # provider log users out of Discourse by POSTing logout tokens to
+    # /backchannel_logout. The API key must be allowed to look up users and to
+    # log them out, for example an admin scoped key acting as
+    # DISCOURSE_API_USERNAME.
+    DISCOURSE_API_KEY = os.environ.get("DISCOURSE_API_KEY", "")
+    DISCOURSE_API_USERNAME = os.environ.get("DISCOURSE_API_USERNAME", "system")
+
+    # Logouts are queued and sent to Discourse in batches by a background
+    # thread, retrying failed logouts with exponential backoff. Logout tokens
+    # arriving while the queue is full are rejected with 503.
+    BACKCHANNEL_LOGOUT_QUEUE_SIZE = int(
+        os.environ.get("BACKCHANNEL_LOGOUT_QUEUE_SIZE", "1000")
+    )
+    BACKCHANNEL_LOGOUT_BATCH_SIZE = int(
+        os.environ.get("BACKCHANNEL_LOGOUT_BATCH_SIZE", "50")
+    )
+    BACKCHANNEL_LOGOUT_MAX_ATTEMPTS = int(
+        os.environ.get("BACKCHANNEL_LOGOUT_MAX_ATTEMPTS", "5")
+    )
+    BACKCHANNEL_LOGOUT_RETRY_DELAY = float(
+        os.environ.get("BACKCHANNEL_LOGOUT_RETRY_DELAY", "1")
+    )
+
     ########################
     # Bridge Configuration #
     ########################
@@ -83,6 +125,20 @@ class DefaultConfig(object):
         )
     )
 
+    # Transformations to apply to the userinfo claims before they are mapped to
+    # Discourse SSO attributes with USERINFO_SSO_MAP, see claims.py for the
+    # available transformations. Example JSON formatted string that could be
+    # passed to lowercase the email and derive a username from it. The claim
+    # mapped to external_id can't be transformed if DISCOURSE_API_KEY is set, as
+    # back-channel logout finds users by the untransformed claim.
+    # """
+    # [
+    #     {"op": "lowercase", "claim": "email"},
+    #     {"op": "extract", "claim": "email", "pattern": "^([^@]+)@", "target": "preferred_username"}
+    # ]
+    # """
+    CLAIM_TRANSFORMS = json.loads(os.environ.get("CLAIM_TRANSFORMS", "[]"))
+
     # If you want some default values to be sent back to discourse, you can add
     # such defaults here. Note that you probably only want to set those that
     # discourse knows about.
@@ -96,3 +152,54 @@ class DefaultConfig(object):
     # }
     # """
     DEFAULT_SSO_ATTRIBUTES = json.loads(os.environ.get("DEFAULT_SSO_ATTRIBUTES", "{}"))
+
+    #######################
+    # Audit Configuration #
+    #######################
+
+    # Set AUDIT_LOG_PATH to write one JSON line per login or aborted login to a
+    # file, or to "-" to write them to stdout. The path may contain {pid} to
+    # write one file per worker process, which is needed for rotation to work
+    # with multiple workers. Files are rotated when they would grow beyond
+    # AUDIT_LOG_MAX_BYTES, keeping AUDIT_LOG_BACKUP_COUNT old files.
+    AUDIT_LOG_PATH = os.environ.get("AUDIT_LOG_PATH", "")
+    AUDIT_LOG_MAX_BYTES = int(os.environ.get("AUDIT_LOG_MAX_BYTES", "10485760"))
+    AUDIT_LOG_BACKUP_COUNT = int(os.environ.get("AUDIT_LOG_BACKUP_COUNT", "5"))
+
+    # Alternatively, set AUDIT_SINK to an import path like "package.module:name"
+    # of a callable returning an object with a write(events) method, called
+    # with batches of events from a background thread.
+    AUDIT_SINK = os.environ.get("AUDIT_SINK", "")
+
+    # Events are buffered in memory and written in batches of up to
+    # AUDIT_BATCH_SIZE events, at least every AUDIT_FLUSH_INTERVAL seconds.
+    # Events arriving while AUDIT_BUFFER_SIZE events are buffered are dropped.
+    AUDIT_BUFFER_SIZE = int(os.environ.get("AUDIT_BUFFER_SIZE", "10000"))
+    AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "500"))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "1"))
+
+    # Set DEBUG_STATS_TOKEN to enable the /debug/stats endpoint, reporting
+    # statistics about the worker process serving the request. Requests must
+    # pass the token in a "Authorization: Bearer <token>" header.
+    DEBUG_STATS_TOKEN = os.environ.get("DEBUG_STATS_TOKEN", "")
+
+    ###########################
+    # Profiling Configuration #
+    ###########################
+
+    # Set PROFILING_DIR to a directory to profile requests with cProfile and
+    # write one .prof file per profiled request there. A fraction of requests
+    # to PROFILING_PATHS, given by PROFILING_SAMPLE_RATE, are profiled.
+    #
+    # Setting PROFILING_SLOW_REQUEST_SECONDS will also write a profile for any
+    # request slower than that, but it requires all requests to be profiled
+    # which adds overhead.
+    #
+    # Only the most recent PROFILING_MAX_FILES files are kept.
+    PROFILING_DIR = os.environ.get("PROFILING_DIR", "")
+    PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0.01"))
+    PROFILING_PATHS = os.environ.get("PROFILING_PATHS", "/sso/login,/sso/auth")
+    PROFILING_SLOW_REQUEST_SECONDS = float(
+        os.environ.get("PROFILING_SLOW_REQUEST_SECONDS", "0")
+    )
+    PROFILING_MAX_FILES = int(os.environ.get("PROFILING_MAX_FILES", "100"))
@@ -0,0 +1,108 @@
+"""
+Opt-in WSGI middleware profiling requests with cProfile, to find out where time
+is spent during slow logins. It is only installed by create_app when
+PROFILING_DIR is configured, so it adds no overhead when disabled.
+
+The written .prof files can be inspected with pstats, or visualized as
+flamegraphs by tools like snakeviz or flameprof.
+"""
+
+import cProfile
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles a sampled fraction of requests to some paths, and optionally every
+    request slower than a threshold, writing one .prof file per profiled
+    request to a directory that keeps at most max_files files.
+    """
+
+    def __init__(
+        self,
+        wsgi_app,
+        profile_dir,
+        sample_rate=0.01,
+        paths=("/sso/login", "/sso/auth"),
+        slow_request_seconds=0,
+        max_files=100,
+    ):
+        self.wsgi_app = wsgi_app
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.paths = frozenset(paths)
+        self.slow_request_seconds = slow_request_seconds
+        self.max_files = max_files
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        sampled = path in self.paths and random.random() < self.sample_rate
+        if not sampled and not self.slow_request_seconds:
+            return self.wsgi_app(environ, start_response)
+
+        # cProfile only supports one active profiler at a time on Python 3.12+,
+        # so concurrent requests are served unprofiled in that case.
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return self.wsgi_app(environ, start_response)
+
+        status = []
+
+        def profiled_start_response(status_line, headers, exc_info=None):
+            status.append(status_line.split(" ", 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        start = time.perf_counter()
+        try:
+            app_iter = self.wsgi_app(environ, profiled_start_response)
+            try:
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        if sampled or elapsed >= self.slow_request_seconds:
+            self.write_profile(profiler, path, status[0] if status else "000", elapsed)
+        return body
+
+    def write_profile(self, profiler, path, status, elapsed):
+        filename = "{:.6f}-{}-{}-{}-{:.0f}ms.prof".format(
+            time.time(),
+            os.getpid(),
+            path.strip("/").replace("/", "_") or "root",
+            status,
+            elapsed * 1000,
+        )
+        try:
+            profiler.dump_stats(os.path.join(self.profile_dir, filename))
+            self.rotate()
+        except OSError as e:
+            logger.warning(f"Failed to write profile {filename}: {e}")
+
+    def rotate(self):
+        """Remove the oldest .prof files beyond max_files."""
+        entries = [
+            entry
+            for entry in os.scandir(self.profile_dir)
+            if entry.name.endswith(".prof")
+        ]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda entry: entry.name)
+        for entry in entries[: len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # another worker rotated it first
+                pass
@@ -0,0 +1,122 @@
+"""
+Cheap per-worker statistics exposed by the /debug/stats endpoint. Everything
+here is kept up to date as requests are served, so taking a snapshot never
+needs to scan anything and can be done every few seconds.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Config keys that hold or may hold credentials, such as the client secret
+# embedded in OIDC_CLIENT_METADATA or a password in a redis:// URL.
+SECRET_CONFIG_KEYS = re.compile(
+    r"SECRET|KEY|TOKEN|PASSWORD|^OIDC_CLIENT_METADATA$|^USERINFO_CACHE$"
+)
+
+
+class Stats(object):
+    """
+    Counters and gauges for a worker process, safe to update from concurrent
+    threads and greenlets. Other components can register a source, a callable
+    returning a JSON serializable dict, to be included in snapshots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._gauges = collections.Counter()
+        self._sources = {}
+        self.started = time.time()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    @contextmanager
+    def in_flight(self, name):
+        with self._lock:
+            self._gauges[name] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._gauges[name] -= 1
+
+    def register_source(self, name, source):
+        self._sources[name] = source
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        snapshot = {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "rss_bytes": rss_bytes(),
+            "counters": counters,
+            "in_flight": gauges,
+        }
+        for name, source in self._sources.items():
+            snapshot[name] = source()
+        return snapshot
+
+
+def public_config_version(config):
+    """
+    Returns a short hash of the config identifying its version, for example to
+    tell if all workers run with the same config. Keys that may hold
+    credentials are left out, so the hash reveals nothing about them.
+    """
+    public_config = {
+        key: value
+        for key, value in config.items()
+        if not SECRET_CONFIG_KEYS.search(key)
+    }
+    return hashlib.sha256(
+        json.dumps(public_config, default=str, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:12]
+
+
+def rss_bytes():
+    """
+    Returns the current resident set size of this process. Outside Linux,
+    where /proc is unavailable, the peak resident set size is returned.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, but in kilobytes elsewhere
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def http_pool_stats(requests_session):
+    """
+    Returns the utilisation of the connection pools of a requests session,
+    one pool per host that has been connected to.
+    """
+    pools = {}
+    for prefix, adapter in requests_session.adapters.items():
+        pool_manager = getattr(adapter, "poolmanager", None)
+        if pool_manager is None:
+            continue
+        for key in pool_manager.pools.keys():
+            pool = pool_manager.pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "maxsize": pool.pool.maxsize,
+                "in_use": pool.pool.maxsize - pool.pool.qsize(),
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+            }
+    return pools
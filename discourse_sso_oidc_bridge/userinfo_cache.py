@@ -0,0 +1,214 @@
+"""
+A cache of userinfo responses from the OIDC provider, keyed by the issuer and
+the subject of a verified ID token, configured with USERINFO_CACHE.
+
+A user returning to Discourse repeatedly, for example with multiple tabs or by
+hopping between forums, is authenticated with the provider each time. With the
+cache, the userinfo request is skipped if the same user's userinfo was fetched
+less than USERINFO_CACHE_TTL seconds ago. The ID token is still verified for
+every login, and cached userinfo is invalidated when the user logs out.
+
+Two backends are available:
+
+- "memory": a bounded LRU cache in each worker process, shared by the threads
+  or greenlets of the worker. A logout only invalidates the entry in the worker
+  handling it, other workers keep their entry until it expires.
+- "redis://host:port/db": a Redis server shared by all workers, requiring the
+  redis package. Entries expire after the TTL, and the server should be
+  configured to bound its memory, for example with maxmemory and the
+  allkeys-lru eviction policy.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import flask
+from oic.oic.message import OpenIDSchema
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend(object):
+    """
+    A thread safe LRU cache holding at most maxsize entries, each for at most
+    ttl seconds.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self._counts["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats["size"] = len(self._entries)
+        stats["maxsize"] = self.maxsize
+        return stats
+
+
+class RedisBackend(object):
+    """
+    A cache in a Redis server, shared by all workers connecting to it.
+    """
+
+    def __init__(self, url, ttl=60, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ValueError(
+                    "USERINFO_CACHE: the redis package is required for a redis:// cache"
+                )
+            client = redis.Redis.from_url(
+                url, socket_timeout=1, socket_connect_timeout=1
+            )
+        self.ttl = ttl
+        self._client = client
+
+    def get(self, key):
+        value = self._client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self._client.set(key, json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def stats(self):
+        return {}
+
+
+class UserinfoCache(object):
+    """
+    Userinfo claims cached by subject, for the provider with the given issuer.
+    Errors from the backend are logged and treated as cache misses, so that
+    an unavailable cache doesn't prevent logins.
+    """
+
+    def __init__(self, backend, issuer):
+        self.backend = backend
+        self.issuer = issuer
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+
+    def get(self, sub):
+        try:
+            claims = self.backend.get(self._key(sub))
+        except Exception as e:
+            logger.warning("Failed to get cached userinfo: %s", e)
+            self._count("errors")
+            claims = None
+        self._count("hits" if claims is not None else "misses")
+        return claims
+
+    def set(self, sub, claims):
+        try:
+            self.backend.set(self._key(sub), claims)
+        except Exception as e:
+            logger.warning("Failed to cache userinfo: %s", e)
+            self._count("errors")
+
+    def invalidate(self, sub):
+        try:
+            self.backend.delete(self._key(sub))
+        except Exception as e:
+            logger.warning("Failed to invalidate cached userinfo: %s", e)
+            self._count("errors")
+        else:
+            self._count("invalidations")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        stats.update(self.backend.stats())
+        return stats
+
+    def _key(self, sub):
+        digest = hashlib.sha256(f"{self.issuer}\0{sub}".encode("utf-8")).hexdigest()
+        return f"discourse-sso-oidc-bridge:userinfo:{digest}"
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+
+def load_userinfo_cache(url, issuer, maxsize=10000, ttl=60):
+    """
+    Returns a UserinfoCache with the backend given by a USERINFO_CACHE value.
+    """
+    if url == "memory":
+        backend = MemoryBackend(maxsize=maxsize, ttl=ttl)
+    elif url.startswith(("redis://", "rediss://", "unix://")):
+        backend = RedisBackend(url, ttl=ttl)
+    else:
+        raise ValueError(
+            f"USERINFO_CACHE: expected 'memory' or a redis:// URL, got {url!r}"
+        )
+    return UserinfoCache(backend, issuer)
+
+
+def cache_userinfo_requests(client, cache):
+    """
+    Make a flask-pyoidc client consult the cache for userinfo requests made
+    after an ID token has been verified in the same request. The userinfo
+    request is made with the access token alone, so the subject of the
+    verified ID token is remembered for the duration of the request.
+    """
+    verify_id_token = client.verify_id_token
+    userinfo_request = client.userinfo_request
+
+    def verify_id_token_and_remember_sub(id_token, auth_request):
+        verify_id_token(id_token, auth_request)
+        flask.g.verified_sub = id_token["sub"]
+
+    def cached_userinfo_request(access_token):
+        sub = flask.g.pop("verified_sub", None)
+        if sub is None:
+            return userinfo_request(access_token)
+
+        claims = cache.get(sub)
+        if claims is not None:
+            return OpenIDSchema(**claims)
+
+        userinfo = userinfo_request(access_token)
+        if userinfo is not None and userinfo.get("sub") == sub:
+            cache.set(sub, userinfo.to_dict())
+        return userinfo
+
+    client.verify_id_token = verify_id_token_and_remember_sub
+    client.userinfo_request = cached_userinfo_request
@@ -0,0 +1,45 @@
+"""
+Gunicorn serving profiles for the bridge.
+
+Each module in this package is a gunicorn config module for a serving profile,
+selected when starting gunicorn like this:
+
+    gunicorn -c python:discourse_sso_oidc_bridge_serving.prefork discourse_sso_oidc_bridge:app
+    gunicorn -c python:discourse_sso_oidc_bridge_serving.threaded discourse_sso_oidc_bridge:app
+    gunicorn -c python:discourse_sso_oidc_bridge_serving.cooperative discourse_sso_oidc_bridge:app
+
+The configs live outside the discourse_sso_oidc_bridge package, as importing
+that package creates the app, and gunicorn imports its config in the master
+process. That would import ssl before the gevent worker gets to monkey-patch
+it, which breaks HTTPS requests to the OIDC provider in the cooperative profile.
+
+Logins mostly wait on the OIDC provider, so the profiles are tuned for I/O
+bound work. The defaults below are shared by all profiles, and all settings can
+be tuned with environment variables.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get(
+    "BIND", f'{os.environ.get("IP", "0.0.0.0")}:{os.environ.get("PORT", "8080")}'
+)
+
+# Discourse SSO payloads fit well within gunicorn's default limit on the length
+# of the request line. The limit can be lowered, but never disabled.
+limit_request_line = int(os.environ.get("GUNICORN_LIMIT_REQUEST_LINE", "8190"))
+if not 0 < limit_request_line <= 8190:
+    raise ValueError(
+        f"GUNICORN_LIMIT_REQUEST_LINE must be between 1 and 8190, got {limit_request_line}"
+    )
+
+# A login can't complete faster than the OIDC provider responds, so allow for a
+# slow provider before a worker is considered stuck.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# Set GUNICORN_ACCESSLOG to an empty string to disable access logs.
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-") or None
+
+cpu_count = multiprocessing.cpu_count()
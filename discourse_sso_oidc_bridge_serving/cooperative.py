@@ -0,0 +1,26 @@
+"""
+Gunicorn config for the cooperative serving profile, where each worker process
+serves requests in greenlets using gevent. Waiting on the OIDC provider is
+cheap here, so this profile serves the most concurrent logins per process.
+
+Requires gevent to be installed, for example with:
+
+    pip install discourse-sso-oidc-bridge-consideratio[gevent]
+    gunicorn -c python:discourse_sso_oidc_bridge_serving.cooperative discourse_sso_oidc_bridge:app
+"""
+
+import os
+
+from . import (
+    accesslog,
+    bind,
+    cpu_count,
+    graceful_timeout,
+    keepalive,
+    limit_request_line,
+    timeout,
+)
+
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", str(cpu_count)))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "256"))
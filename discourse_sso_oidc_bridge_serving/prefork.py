@@ -0,0 +1,22 @@
+"""
+Gunicorn config for the prefork serving profile, where each worker process
+serves one request at a time. This is the most conservative profile, but it
+needs many processes to serve logins concurrently.
+
+    gunicorn -c python:discourse_sso_oidc_bridge_serving.prefork discourse_sso_oidc_bridge:app
+"""
+
+import os
+
+from . import (
+    accesslog,
+    bind,
+    cpu_count,
+    graceful_timeout,
+    keepalive,
+    limit_request_line,
+    timeout,
+)
+
+worker_class = "sync"
+workers = int(os.environ.get("WEB_CONCURRENCY", str(cpu_count * 2 + 1)))
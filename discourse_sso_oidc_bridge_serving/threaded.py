@@ -0,0 +1,23 @@
+"""
+Gunicorn config for the threaded serving profile, where each worker process
+serves requests from a pool of threads. Set OIDC_HTTP_POOL_MAXSIZE to at least
+the number of threads so connections to the OIDC provider can be reused.
+
+    gunicorn -c python:discourse_sso_oidc_bridge_serving.threaded discourse_sso_oidc_bridge:app
+"""
+
+import os
+
+from . import (
+    accesslog,
+    bind,
+    cpu_count,
+    graceful_timeout,
+    keepalive,
+    limit_request_line,
+    timeout,
+)
+
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", str(cpu_count)))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
@@ -27,6 +27,11 @@ setup(
         "flask==2.0.*",
         "healthcheck",
     ],
+    extras_require={
+        "gunicorn": ["gunicorn"],
+        "gevent": ["gunicorn", "gevent"],
+        "redis": ["redis"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: Apache Software License",
@@ -4,11 +4,17 @@ Tests to verify most of the functionality
 
 import time
 import json
+import pstats
+import threading
 from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 import pytest
 from base64 import b64decode
-from urllib.parse import urlparse, unquote
+from urllib.parse import parse_qsl, urlparse, unquote
+from requests.cookies import create_cookie
 from discourse_sso_oidc_bridge import create_app
+from discourse_sso_oidc_bridge.profiling import ProfilingMiddleware
 
 
 @pytest.fixture
@@ -327,3 +333,275 @@ def test_static_oidc_configuration_issuer():
         assert res.status_code == 302
         assert urlparse(res.location).netloc == "op.example.com"
         assert urlparse(res.location).path == "/a_very_unique_auth"
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def discovery_server():
+    """A local OIDC provider serving only its discovery document"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), None)
+    server.issuer = f"http://127.0.0.1:{server.server_address[1]}"
+    server.requests = 0
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            server.requests += 1
+            body = json.dumps(
+                {
+                    "issuer": server.issuer,
+                    "authorization_endpoint": server.issuer + "/auth",
+                }
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server.RequestHandlerClass = Handler
+    threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    ).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_oidc_http_pool(discovery_server):
+    """Test that discovery uses the pooled session, which is closed afterwards"""
+    with client_maker(
+        {
+            "OIDC_ISSUER": discovery_server.issuer,
+            "OIDC_PROVIDER_METADATA": {},
+            "OIDC_HTTP_POOL_MAXSIZE": 42,
+        }
+    ) as client:
+        auth = client.application.extensions["oidc_auth"]
+        requests_session = auth.clients[
+            "default"
+        ]._provider_configuration.requests_session
+        assert discovery_server.requests == 1
+        for adapter in requests_session.adapters.values():
+            assert adapter._pool_maxsize == 42
+            # No connection opened during discovery is left for forked workers
+            assert len(adapter.poolmanager.pools) == 0
+
+
+def test_oidc_client_keeps_no_cookies(client):
+    """Test that the pyoidc client shared by all requests drops cookies"""
+    auth = client.application.extensions["oidc_auth"]
+    cookiejar = auth.clients["default"]._client.cookiejar
+    cookiejar.set_cookie(
+        create_cookie("a_very_unique_cookie", "value", domain="op.example.com")
+    )
+    assert list(cookiejar) == []
+
+
+def test_profiling_disabled_by_default(client):
+    """Test that requests aren't profiled unless PROFILING_DIR is configured"""
+    assert not isinstance(client.application.wsgi_app, ProfilingMiddleware)
+
+
+def test_profiling_sampled_requests(tmp_path):
+    """Test that sampled requests are profiled to PROFILING_DIR with rotation"""
+    with client_maker(
+        {
+            "PROFILING_DIR": str(tmp_path),
+            "PROFILING_SAMPLE_RATE": 1.0,
+            "PROFILING_MAX_FILES": 2,
+        }
+    ) as client:
+        for _ in range(3):
+            assert client.get("/sso/login").status_code == 400
+        assert client.get("/health").status_code == 200
+
+    profiles = sorted(tmp_path.iterdir())
+    assert len(profiles) == 2
+    assert all("-sso_login-400-" in p.name for p in profiles)
+    assert pstats.Stats(str(profiles[0])).total_calls > 0
+
+
+def test_profiling_slow_requests(tmp_path):
+    """Test that requests slower than the threshold are profiled on any path"""
+    with client_maker(
+        {
+            "PROFILING_DIR": str(tmp_path),
+            "PROFILING_SAMPLE_RATE": 0.0,
+            "PROFILING_SLOW_REQUEST_SECONDS": 1e-9,
+        }
+    ) as client:
+        assert client.get("/health").status_code == 200
+
+    assert [p.name for p in tmp_path.iterdir() if "-health-200-" in p.name]
+
+
+def test_debug_stats_disabled_by_default(client):
+    """Test that /debug/stats is unavailable unless DEBUG_STATS_TOKEN is configured"""
+    assert client.get("/debug/stats").status_code == 404
+
+
+def test_debug_stats(discourse_nonce, auth_data):
+    """Test that /debug/stats requires the token and reports worker statistics"""
+    with client_maker({"DEBUG_STATS_TOKEN": "a_very_unique_token"}) as client:
+        assert client.get("/debug/stats").status_code == 401
+        assert (
+            client.get(
+                "/debug/stats", headers={"Authorization": "Bearer wrong_token"}
+            ).status_code
+            == 401
+        )
+
+        assert client.get("/sso/login").status_code == 400
+        with client.session_transaction() as session:
+            session.update(discourse_nonce)
+            session.update(auth_data)
+        assert client.get("/sso/auth").status_code == 302
+
+        res = client.get(
+            "/debug/stats", headers={"Authorization": "Bearer a_very_unique_token"}
+        )
+        assert res.status_code == 200
+        stats = json.loads(res.get_data())
+        assert stats["counters"] == {
+            "aborts.sso_login.missing_payload_or_signature": 1,
+            "logins": 1,
+        }
+        assert stats["in_flight"] == {"sso_auth": 0}
+        assert stats["rss_bytes"] > 0
+        assert stats["config"]["version"]
+
+
+def test_debug_stats_config_version_excludes_secrets():
+    """Test that the published config version is not derived from secrets"""
+
+    def config_version(config):
+        with client_maker(
+            {"DEBUG_STATS_TOKEN": "a_very_unique_token", **config}
+        ) as client:
+            res = client.get(
+                "/debug/stats", headers={"Authorization": "Bearer a_very_unique_token"}
+            )
+            return json.loads(res.get_data())["config"]["version"]
+
+    version = config_version({})
+    for secret in [
+        "SECRET_KEY",
+        "DISCOURSE_SECRET_KEY",
+        "OIDC_CLIENT_SECRET",
+        "DISCOURSE_API_KEY",
+    ]:
+        assert config_version({secret: "a_very_unique_secret"}) == version
+    assert config_version({"DISCOURSE_URL": "https://forum.example.com"}) != version
+
+
+def test_prepared_responses(client, auth_data):
+    """Test the caching headers of prepared redirects and error pages"""
+    res = client.get("/")
+    assert res.status_code == 302
+    assert res.location == "https://discourse.example.com"
+    assert res.headers["Cache-Control"] == "private, max-age=300"
+
+    res = client.get("/sso/login")
+    assert res.status_code == 400
+    assert res.headers["Cache-Control"] == "no-store"
+
+    with client.session_transaction() as session:
+        session.update(auth_data)
+    res = client.get("/sso/auth")
+    assert res.status_code == 403
+    assert res.headers["Cache-Control"] == "no-store"
+    assert b"Attributes not provided" in res.get_data()
+
+
+def test_index_with_session_is_not_publicly_cacheable(client, auth_data):
+    """Test that a redirect refreshing a session cookie isn't cached publicly"""
+    with client.session_transaction() as session:
+        session.permanent = True
+        session.update(auth_data)
+    res = client.get("/")
+    assert res.status_code == 302
+    assert "session=" in res.headers["Set-Cookie"]
+    assert "public" not in res.headers["Cache-Control"]
+    assert "private" in res.headers["Cache-Control"]
+
+
+def test_configured_claim_transforms(discourse_nonce, auth_data):
+    """Test that userinfo claims are transformed before being mapped"""
+    auth_data["userinfo"].update(
+        {
+            "email": "John_Doe@Example.com",
+            "given_name": "John",
+            "family_name": "Doe",
+            "groups": ["discourse-cats", "unrelated", "discourse-dogs"],
+        }
+    )
+    with client_maker(
+        {
+            "USERINFO_SSO_MAP": {"sub": "external_id"},
+            "CLAIM_TRANSFORMS": [
+                {"op": "lowercase", "claim": "email"},
+                {
+                    "op": "extract",
+                    "claim": "email",
+                    "pattern": "^([^@]+)@",
+                    "target": "username",
+                },
+                {
+                    "op": "concat",
+                    "claims": ["given_name", "family_name"],
+                    "target": "name",
+                    "separator": ", ",
+                },
+                {"op": "filter", "claim": "groups", "pattern": "^discourse-"},
+                {
+                    "op": "replace",
+                    "claim": "groups",
+                    "pattern": "^discourse-",
+                    "replacement": "",
+                },
+                {"op": "join", "claim": "groups"},
+            ],
+        }
+    ) as client:
+        with client.session_transaction() as session:
+            session.update(discourse_nonce)
+            session.update(auth_data)
+
+        res = client.get("/sso/auth")
+        assert res.status_code == 302
+        # Reconstruct query parameters encoded in the sso query parameter
+        query = urlparse(res.location).query
+        query = str.split(query, "&")[0][4:]
+        query = dict(parse_qsl(b64decode(unquote(query)).decode("utf8")))
+        assert query["email"] == "john_doe@example.com"
+        assert query["username"] == "john_doe"
+        assert query["name"] == "John, Doe"
+        assert query["groups"] == "cats,dogs"
+
+
+@pytest.mark.parametrize(
+    "transform",
+    [
+        {"op": "a_very_unique_op", "claim": "email"},
+        {"op": "lowercase"},
+        {"op": "extract", "claim": "email", "pattern": "("},
+        {"op": "concat", "claims": "email", "target": "name"},
+        {"op": "concat", "claims": ["email", 1], "target": "name"},
+        {"op": "concat", "claims": ["email"], "target": "name", "separator": None},
+        {"op": "lowercase", "claim": ["email"]},
+        {"op": "join", "claim": "groups", "separator": 1},
+        {"op": "copy", "claim": "email", "target": {"a_very_unique": "target"}},
+    ],
+)
+def test_invalid_claim_transforms(transform):
+    """Test that invalid claim transforms are rejected when creating the app"""
+    with pytest.raises(ValueError, match=r"CLAIM_TRANSFORMS\[0\]"):
+        create_app({"CLAIM_TRANSFORMS": [transform]})
@@ -0,0 +1,133 @@
+"""
+Tests of the audit log of logins
+"""
+
+import json
+import time
+
+import pytest
+from discourse_sso_oidc_bridge import create_app
+from discourse_sso_oidc_bridge.audit import AuditLog, JSONLinesFile
+
+SSO_LOGIN = (
+    "/sso/login?sso=bm9uY2U9Y2I2ODI1MWVlZmI1MjExZTU4YzAwZmYxMzk1ZjBjMGI%3D%0A&"
+    "sig=d87265a513d3fa4c7602ada38cfa60318c9804da6c95785ab36885dc79641671"
+)
+
+
+class ListSink(object):
+    def __init__(self):
+        self.batches = []
+
+    def write(self, events):
+        self.batches.append(events)
+
+
+def authenticate(client, **userinfo):
+    with client.session_transaction() as session:
+        session.update(
+            {
+                "access_token": "test_access_token",
+                "id_token": {"iss": "issuer1", "aud": "client1", "sub": "john_doe"},
+                "id_token_jwt": "test.id.token",
+                "userinfo": {"sub": "john_doe", "email": "john_doe@example.com"},
+                "last_authenticated": time.time(),
+            }
+        )
+        session["userinfo"].update(userinfo)
+
+
+def test_audit_log_disabled_by_default():
+    """Test that no audit log is created unless a sink is configured"""
+    app = create_app()
+    assert "audit_log" not in app.extensions
+
+
+def test_audit_log_file(tmp_path):
+    """Test that logins and aborted logins are written as JSON lines"""
+    path = tmp_path / "audit.jsonl"
+    app = create_app({"AUDIT_LOG_PATH": str(path)})
+    client = app.test_client()
+
+    assert client.get("/sso/login").status_code == 400
+    assert client.get(SSO_LOGIN).status_code == 302
+    authenticate(client)
+    assert client.get("/sso/auth").status_code == 302
+    authenticate(client, email="")
+    assert client.get("/sso/auth").status_code == 403
+    assert app.extensions["audit_log"].flush(timeout=5)
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(e["event"], e["outcome"], e["external_id"]) for e in events] == [
+        ("abort", "sso_login.missing_payload_or_signature", None),
+        ("login", "success", "john_doe"),
+        ("abort", "sso_auth.missing_required_attribute", "john_doe"),
+    ]
+    assert all(e["ip"] == "127.0.0.1" for e in events)
+    assert set(events[1]["latency_ms"]) == {"authentication", "sso_auth"}
+    assert events[1]["timestamp"] == pytest.approx(time.time(), abs=60)
+
+
+def test_audit_log_pluggable_sink():
+    """Test that a configured sink receives events in batches"""
+    sink = ListSink()
+    app = create_app({"AUDIT_SINK": sink, "AUDIT_BATCH_SIZE": 2})
+    client = app.test_client()
+    for _ in range(5):
+        client.get("/sso/login")
+    assert app.extensions["audit_log"].flush(timeout=5)
+
+    assert sum(len(batch) for batch in sink.batches) == 5
+    assert max(len(batch) for batch in sink.batches) <= 2
+
+
+@pytest.mark.parametrize("sink", ["no_colon", "json:JSONDecoder"])
+def test_audit_log_invalid_sink(sink):
+    """Test that an invalid sink is rejected when creating the app"""
+    with pytest.raises(ValueError, match="AUDIT_SINK"):
+        create_app({"AUDIT_SINK": sink})
+
+
+def test_audit_log_is_bounded():
+    """Test that a full buffer drops events instead of blocking"""
+    audit_log = AuditLog(ListSink(), buffer_size=2)
+    with audit_log.worker.held():
+        assert audit_log.emit({"n": 1})
+        assert audit_log.emit({"n": 2})
+        assert not audit_log.emit({"n": 3})
+        stats = audit_log.stats()
+    assert stats["dropped"] == 1
+    assert stats["buffered"] == 2
+
+
+def test_audit_log_survives_failing_sink():
+    """Test that events failing to be written are counted"""
+
+    class FailingSink(object):
+        def write(self, events):
+            raise OSError("disk full")
+
+    audit_log = AuditLog(FailingSink())
+    audit_log.emit({"n": 1})
+    assert audit_log.flush(timeout=5)
+    assert audit_log.stats()["failed"] == 1
+
+
+def test_json_lines_file_rotation(tmp_path):
+    """Test that the file is rotated and old files are removed"""
+    path = tmp_path / "audit.jsonl"
+    sink = JSONLinesFile(str(path), max_bytes=130, backup_count=2)
+    for n in range(10):
+        sink.write([{"n": n, "padding": "x" * 40}])
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "audit.jsonl",
+        "audit.jsonl.1",
+        "audit.jsonl.2",
+    ]
+    lines = [
+        json.loads(line)["n"]
+        for name in ["audit.jsonl.2", "audit.jsonl.1", "audit.jsonl"]
+        for line in (tmp_path / name).read_text().splitlines()
+    ]
+    assert lines == list(range(4, 10))
@@ -0,0 +1,243 @@
+"""
+Tests of OIDC back-channel logout against a local fake Discourse
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+from discourse_sso_oidc_bridge import create_app
+from discourse_sso_oidc_bridge.backchannel_logout import DiscourseLogoutQueue
+
+ISSUER = "https://op.example.com"
+BACKCHANNEL_LOGOUT_EVENT = "http://schemas.openid.net/event/backchannel-logout"
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def fake_discourse():
+    """
+    A fake Discourse knowing the user with external_id john_doe as user 42.
+    Set fake_discourse.failures to respond with 503 to that many requests.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), None)
+    server.logged_out = []
+    server.api_keys = set()
+    server.failures = 0
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def respond(self, status, data=None):
+            body = json.dumps(data or {}).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            server.api_keys.add(self.headers["Api-Key"])
+            if server.failures:
+                server.failures -= 1
+                self.respond(503)
+            elif self.path == "/u/by-external/john_doe.json":
+                self.respond(200, {"user": {"id": 42}})
+            else:
+                self.respond(404)
+
+        def do_POST(self):
+            if self.path == "/admin/users/42/log_out.json":
+                server.logged_out.append(42)
+                self.respond(200, {"success": "OK"})
+            else:
+                self.respond(404)
+
+    server.RequestHandlerClass = Handler
+    threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    ).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@contextmanager
+def client_maker(config):
+    app = create_app(
+        {
+            "OIDC_PROVIDER_METADATA": {
+                "issuer": ISSUER,
+                "authorization_endpoint": ISSUER + "/auth",
+            },
+            "DISCOURSE_API_KEY": "a_very_unique_api_key",
+            "BACKCHANNEL_LOGOUT_RETRY_DELAY": 0.01,
+            **config,
+        }
+    )
+    with app.app_context():
+        yield app.test_client()
+
+
+def logout_token(secret="dummy_client_secret", alg="HS256", **claims):
+    """Make a logout token signed with the client secret like a provider could."""
+
+    def b64(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=")
+
+    claims = {
+        "iss": ISSUER,
+        "aud": "dummy_client_id",
+        "iat": int(time.time()),
+        "jti": "a_very_unique_jti",
+        "events": {BACKCHANNEL_LOGOUT_EVENT: {}},
+        "sub": "john_doe",
+        **claims,
+    }
+    signing_input = b64({"alg": alg, "typ": "logout+jwt"}) + b"." + b64(claims)
+    if alg == "none":
+        return (signing_input + b".").decode()
+    sig = hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + base64.urlsafe_b64encode(sig).rstrip(b"=")).decode()
+
+
+def test_backchannel_logout_disabled_by_default():
+    """Test that /backchannel_logout is unavailable without a Discourse API key"""
+    with client_maker({"DISCOURSE_API_KEY": ""}) as client:
+        res = client.post("/backchannel_logout", data={"logout_token": "x"})
+        assert res.status_code == 404
+
+
+def test_backchannel_logout(fake_discourse):
+    """Test that a valid logout token logs the user out of Discourse"""
+    with client_maker({"DISCOURSE_URL": fake_discourse.url}) as client:
+        res = client.post("/backchannel_logout", data={"logout_token": logout_token()})
+        assert res.status_code == 200
+        assert res.headers["Cache-Control"] == "no-store"
+
+        client.application.extensions["discourse_logout_queue"].join()
+        assert fake_discourse.logged_out == [42]
+        assert fake_discourse.api_keys == {"a_very_unique_api_key"}
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "not_a_token",
+        logout_token(secret="wrong_secret"),
+        logout_token(alg="none"),
+        logout_token(alg=None),
+        logout_token(alg=1),
+        logout_token(iss="https://evil.example.com"),
+        logout_token(aud="another_client_id"),
+        logout_token(iat=int(time.time()) - 3600),
+        logout_token(events={}),
+        logout_token(nonce="a_nonce"),
+    ],
+    ids=[
+        "malformed",
+        "bad_signature",
+        "unsigned",
+        "null_alg",
+        "numeric_alg",
+        "wrong_issuer",
+        "wrong_audience",
+        "expired",
+        "missing_event",
+        "nonce",
+    ],
+)
+def test_backchannel_logout_invalid_token(fake_discourse, token):
+    """Test that invalid logout tokens are rejected"""
+    with client_maker({"DISCOURSE_URL": fake_discourse.url}) as client:
+        res = client.post("/backchannel_logout", data={"logout_token": token})
+        assert res.status_code == 400
+        assert fake_discourse.logged_out == []
+
+
+def test_backchannel_logout_mapped_external_id(fake_discourse):
+    """Test that the claim mapped to external_id must be in the logout token"""
+    with client_maker(
+        {
+            "DISCOURSE_URL": fake_discourse.url,
+            "USERINFO_SSO_MAP": {"a_very_unique_sub": "external_id"},
+        }
+    ) as client:
+        res = client.post("/backchannel_logout", data={"logout_token": logout_token()})
+        assert res.status_code == 400
+
+        token = logout_token(a_very_unique_sub="john_doe")
+        res = client.post("/backchannel_logout", data={"logout_token": token})
+        assert res.status_code == 200
+        client.application.extensions["discourse_logout_queue"].join()
+        assert fake_discourse.logged_out == [42]
+
+
+@pytest.mark.parametrize(
+    "transform",
+    [
+        {"op": "lowercase", "claim": "sub"},
+        {"op": "copy", "claim": "email", "target": "external_id"},
+    ],
+)
+def test_backchannel_logout_rejects_transformed_external_id(transform):
+    """Test that external_id can't be derived by claim transforms, as logout
+    tokens carry untransformed claims"""
+    with pytest.raises(ValueError, match="external_id"):
+        with client_maker({"CLAIM_TRANSFORMS": [transform]}):
+            pass
+    with client_maker({"DISCOURSE_API_KEY": "", "CLAIM_TRANSFORMS": [transform]}):
+        pass
+
+
+def test_discourse_logout_queue_batches_and_retries(fake_discourse):
+    """Test that failed logouts are retried, and duplicates are logged out once"""
+    fake_discourse.failures = 2
+    logout_queue = DiscourseLogoutQueue(
+        fake_discourse.url, "a_very_unique_api_key", retry_delay=0.01
+    )
+    # Queue everything before the worker starts, so it's processed as a batch
+    with logout_queue.worker.held():
+        for external_id in ["john_doe", "john_doe", "jane_doe"]:
+            assert logout_queue.put(external_id)
+    logout_queue.join()
+
+    assert fake_discourse.logged_out == [42]
+    stats = logout_queue.stats()
+    assert stats["logged_out"] == 1
+    assert stats["not_found"] == 1
+    assert stats["retries"] >= 1
+    assert stats["failed"] == 0
+
+
+def test_discourse_logout_queue_is_bounded(fake_discourse):
+    """Test that a full queue drops logouts instead of blocking"""
+    logout_queue = DiscourseLogoutQueue(fake_discourse.url, "key", maxsize=1)
+    with logout_queue.worker.held():
+        assert logout_queue.put("john_doe")
+        assert not logout_queue.put("jane_doe")
+        assert logout_queue.stats()["dropped"] == 1
+
+
+def test_backchannel_logout_invalidates_cached_userinfo(fake_discourse):
+    """Test that a logout token invalidates the user's cached userinfo"""
+    with client_maker(
+        {"DISCOURSE_URL": fake_discourse.url, "USERINFO_CACHE": "memory"}
+    ) as client:
+        userinfo_cache = client.application.extensions["userinfo_cache"]
+        userinfo_cache.set("john_doe", {"sub": "john_doe"})
+        res = client.post("/backchannel_logout", data={"logout_token": logout_token()})
+        assert res.status_code == 200
+        assert userinfo_cache.get("john_doe") is None
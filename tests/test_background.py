@@ -0,0 +1,77 @@
+"""
+Tests of the background threads shared by the audit log and back-channel logout
+"""
+
+import os
+import threading
+import time
+
+import pytest
+from discourse_sso_oidc_bridge.background import BackgroundThread
+
+
+def thread_counter():
+    """Returns a background thread, and a list of the pids it has started in"""
+    started = []
+    stop = threading.Event()
+
+    def target():
+        started.append(os.getpid())
+        stop.wait()
+
+    return BackgroundThread(target, name="test"), started, stop
+
+
+def started_in(started, pid, timeout=5):
+    deadline = time.time() + timeout
+    while pid not in started and time.time() < deadline:
+        time.sleep(0.01)
+    return pid in started
+
+
+def test_background_thread_starts_lazily_once():
+    """Test that the thread isn't started until needed, and then only once"""
+    thread, started, stop = thread_counter()
+    try:
+        assert started == []
+        thread.ensure_started()
+        thread.ensure_started()
+        assert started_in(started, os.getpid())
+        assert started == [os.getpid()]
+    finally:
+        stop.set()
+
+
+def test_background_thread_held():
+    """Test that a held thread starts at the end of the block"""
+    thread, started, stop = thread_counter()
+    try:
+        with thread.held():
+            thread.ensure_started()
+            assert thread._thread is None
+        assert started_in(started, os.getpid())
+    finally:
+        stop.set()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_background_thread_restarts_after_fork():
+    """Test that a forked process starts its own thread"""
+    thread, started, stop = thread_counter()
+    try:
+        thread.ensure_started()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # The parent's thread doesn't exist in the child
+            try:
+                thread.ensure_started()
+                os.write(write_fd, b"1" if started_in(started, os.getpid()) else b"0")
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        assert os.read(read_fd, 1) == b"1"
+        os.waitpid(pid, 0)
+        os.close(read_fd)
+    finally:
+        stop.set()
@@ -0,0 +1,25 @@
+"""
+Tests of the gunicorn configs of the serving profiles
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize("profile", ["prefork", "threaded", "cooperative"])
+def test_serving_profile_does_not_import_app(profile):
+    """
+    Test that gunicorn can load a config without importing ssl or requests,
+    which the gevent worker must monkey-patch before they are imported
+    """
+    code = (
+        f"import sys, discourse_sso_oidc_bridge_serving.{profile} as config; "
+        "print(config.worker_class); "
+        "print(sorted({'ssl', 'requests', 'discourse_sso_oidc_bridge'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    assert output.splitlines()[1] == "[]"
@@ -0,0 +1,158 @@
+"""
+Tests of the userinfo cache
+"""
+
+import time
+
+import pytest
+from discourse_sso_oidc_bridge import create_app
+from discourse_sso_oidc_bridge.userinfo_cache import (
+    MemoryBackend,
+    RedisBackend,
+    UserinfoCache,
+    cache_userinfo_requests,
+)
+from oic.oic.message import OpenIDSchema
+
+
+class FakeClient(object):
+    """Stands in for the flask-pyoidc client making requests to the provider"""
+
+    def __init__(self):
+        self.userinfo_requests = 0
+
+    def verify_id_token(self, id_token, auth_request):
+        pass
+
+    def userinfo_request(self, access_token):
+        self.userinfo_requests += 1
+        return OpenIDSchema(sub=access_token, email=f"{access_token}@example.com")
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key, (None,))[0]
+
+    def set(self, key, value, ex):
+        self.data[key] = (value, ex)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def login(client, sub):
+    """Make the requests flask-pyoidc makes when handling a login"""
+    client.verify_id_token({"sub": sub}, {})
+    return client.userinfo_request(sub).to_dict()
+
+
+def test_userinfo_cache_disabled_by_default():
+    """Test that no userinfo cache is created unless configured"""
+    app = create_app()
+    assert "userinfo_cache" not in app.extensions
+
+
+def test_invalid_userinfo_cache():
+    """Test that an unknown backend is rejected when creating the app"""
+    with pytest.raises(ValueError, match="USERINFO_CACHE"):
+        create_app({"USERINFO_CACHE": "a_very_unique_backend"})
+
+
+def test_cache_userinfo_requests():
+    """Test that repeated logins by a user fetch userinfo once"""
+    app = create_app()
+    client = FakeClient()
+    cache = UserinfoCache(MemoryBackend(), issuer="issuer1")
+    cache_userinfo_requests(client, cache)
+
+    with app.test_request_context():
+        assert login(client, "john_doe") == {
+            "sub": "john_doe",
+            "email": "john_doe@example.com",
+        }
+    for _ in range(2):
+        with app.test_request_context():
+            assert login(client, "john_doe")["email"] == "john_doe@example.com"
+    with app.test_request_context():
+        assert login(client, "jane_doe")["email"] == "jane_doe@example.com"
+    assert client.userinfo_requests == 2
+
+    # Without a verified ID token in the request, the cache isn't consulted
+    with app.test_request_context():
+        client.userinfo_request("john_doe")
+    assert client.userinfo_requests == 3
+
+    stats = cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == 0.5
+
+
+def test_memory_backend_is_bounded():
+    """Test that least recently used and expired entries are evicted"""
+    backend = MemoryBackend(maxsize=2, ttl=60)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    assert backend.get("a") == 1
+    backend.set("c", 3)
+    assert backend.get("b") is None
+    assert backend.get("a") == 1
+    assert backend.get("c") == 3
+
+    backend = MemoryBackend(ttl=0)
+    backend.set("a", 1)
+    assert backend.get("a") is None
+    assert backend.stats() == {
+        "evictions": 0,
+        "expirations": 1,
+        "size": 0,
+        "maxsize": 10000,
+    }
+
+
+def test_redis_backend():
+    """Test that userinfo is stored in Redis as JSON expiring after the TTL"""
+    redis = FakeRedis()
+    cache = UserinfoCache(RedisBackend("redis://", ttl=30, client=redis), "issuer1")
+    cache.set("john_doe", {"sub": "john_doe"})
+    assert cache.get("john_doe") == {"sub": "john_doe"}
+    assert [ex for _, ex in redis.data.values()] == [30]
+    cache.invalidate("john_doe")
+    assert redis.data == {}
+
+
+def test_userinfo_cache_errors_are_misses():
+    """Test that an unavailable cache doesn't prevent logins"""
+
+    class BrokenBackend(MemoryBackend):
+        def get(self, key):
+            raise ConnectionError("a_very_unique_error")
+
+    cache = UserinfoCache(BrokenBackend(), issuer="issuer1")
+    assert cache.get("john_doe") is None
+    assert cache.stats()["errors"] == 1
+
+
+def test_logout_invalidates_cached_userinfo():
+    """Test that /logout invalidates the cached userinfo of the user"""
+    app = create_app({"USERINFO_CACHE": "memory"})
+    userinfo_cache = app.extensions["userinfo_cache"]
+    userinfo_cache.set("john_doe", {"sub": "john_doe"})
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(
+            {
+                "access_token": "test_access_token",
+                "id_token": {"iss": "issuer1", "aud": "client1", "sub": "john_doe"},
+                "id_token_jwt": "test.id.token",
+                "userinfo": {"sub": "john_doe"},
+                "last_authenticated": time.time(),
+            }
+        )
+    assert client.get("/logout").status_code == 302
+    assert userinfo_cache.get("john_doe") is None
+    assert userinfo_cache.stats()["invalidations"] == 1